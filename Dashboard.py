@@ -1,11 +1,20 @@
 import streamlit as st
+import matplotlib
+matplotlib.use("Agg")  # 서버 렌더링 전용: GUI 백엔드 초기화 생략
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
+import numpy as np
 import os
 import matplotlib.font_manager as fm
 
-from prophet_functions import evaluate_forecast_model_prophet, last_df, threshold_df
+from prophet_functions import (
+    evaluate_forecast_model_prophet,
+    load_kpi,
+    load_threshold,
+    KPI_PATH,
+    THRESHOLD_PATH,
+)
 
 # -----------------------------
 # 📄 기본 설정 (한글 폰트 + 스타일)
@@ -20,13 +29,22 @@ from prophet_functions import evaluate_forecast_model_prophet, last_df, threshol
 
 FONT_FILE_NAME = "NanumGothic-Regular.ttf"
 
-try:
-    fm.fontManager.addfont(FONT_FILE_NAME)   # ✅ 같은 폴더에 있으므로 경로 불필요
-    plt.rcParams["font.family"] = "NanumGothic"
-    print("✅ Matplotlib 폰트 설정 완료: NanumGothic")
-except Exception as e:
-    st.warning(f"⚠️ 폰트 로드 실패: {e}")
-    plt.rcParams["font.family"] = "DejaVu Sans"
+# rerun마다 TTF를 다시 파싱하지 않도록 프로세스당 1회만 등록
+@st.cache_resource
+def init_fonts():
+    try:
+        fm.fontManager.addfont(FONT_FILE_NAME)   # ✅ 같은 폴더에 있으므로 경로 불필요
+        plt.rcParams["font.family"] = "NanumGothic"
+        print("✅ Matplotlib 폰트 설정 완료: NanumGothic")
+        return None
+    except Exception as e:
+        plt.rcParams["font.family"] = "DejaVu Sans"
+        return e
+
+
+font_error = init_fonts()
+if font_error is not None:
+    st.warning(f"⚠️ 폰트 로드 실패: {font_error}")
 
 # 마이너스 깨짐 방지
 plt.rcParams["axes.unicode_minus"] = False
@@ -54,8 +72,18 @@ st.markdown(
 # ======================================
 # ⚙️ 1️⃣ Prophet 예측 결과 생성 (기존 코드 유지)
 # ======================================
+# 결과 DataFrame을 복사 없이 참조로 재사용하도록 cache_resource 사용
+# 입력 파일의 수정 시각(mtime)을 키로 사용 → 데이터 변경 시 자동 무효화
+@st.cache_resource
+def run_forecasts(kpi_mtime, threshold_mtime):
+    return evaluate_forecast_model_prophet(load_kpi(kpi_mtime), load_threshold(threshold_mtime))
+
+
 st.info("🔄 예측 실행 중입니다...")
-results_df = evaluate_forecast_model_prophet(last_df, threshold_df)
+results_df = run_forecasts(
+    os.path.getmtime(KPI_PATH),
+    os.path.getmtime(THRESHOLD_PATH),
+)
 
 if results_df is None or results_df.empty or "지표" not in results_df.columns:
     st.error("⚠️ 예측 결과를 불러오지 못했습니다. 데이터나 임계치 구성이 올바른지 확인하세요.")
@@ -78,15 +106,44 @@ selected_indicator = st.radio(
 # 같은 폴더 내에 있는 CSV 파일 경로 지정
 csv_path = "result_prophet_storewise.csv"  
 
+# 미래상태별 색상 (카테고리 코드 순서와 동일, 마지막 "#555"는 미분류/결측용)
+color_map = {
+    "안전": "#1f77b4",  # 파랑
+    "경고": "#ffbf00",  # 노랑
+    "위험": "#d62728"   # 빨강
+}
+status_colors = np.array(list(color_map.values()) + ["#555"])
+
+
+@st.cache_data
+def load_store_status(path):
+    # pyarrow 엔진 + Arrow 문자열 dtype: 파싱과 str 연산을 Arrow 커널에서 처리
+    df = pd.read_csv(
+        path,
+        engine="pyarrow",
+        dtype={"가맹점": "string[pyarrow]", "지표": "string[pyarrow]", "미래상태": "string[pyarrow]"},
+    )
+    df.columns = [c.strip() for c in df.columns]  # 공백 제거
+    df["_id_lower"] = df["가맹점"].str.lower()  # 검색용 소문자 ID (1회 계산)
+
+    # 미래상태 → 카테고리 (안전/경고/위험 순, 그 외 값은 뒤에 추가)
+    status = df["미래상태"].str.strip()
+    extra = sorted(set(status.dropna()) - set(color_map))
+    df["미래상태"] = status.astype(pd.CategoricalDtype(list(color_map) + extra))
+
+    # 전체 ID 입력 시 바로 찾도록 소문자 ID → 행 위치 인덱스 구성
+    id_index = df.groupby("_id_lower").indices
+    return df, id_index
+
 
 try:
-    store_df = pd.read_csv(csv_path)
-    store_df.columns = [c.strip() for c in store_df.columns]  # 공백 제거
+    store_df, store_id_index = load_store_status(csv_path)
     st.success(f"✅ 가맹점 상태 데이터 불러오기 완료")
     st.caption(f"평균 가맹점 KPI와 맞춤형 KPI를 비교해보세요!")
 except Exception as e:
     st.error(f"❌ 가맹점 상태 데이터를 불러올 수 없습니다: {e}")
-    store_df = pd.DataFrame(columns=['가맹점', '지표', '미래상태'])
+    store_df = pd.DataFrame(columns=['가맹점', '지표', '미래상태', '_id_lower'])
+    store_id_index = {}
 
 # ======================================
 # ⚙️ 3️⃣ 메인 레이아웃 (왼쪽 Prophet 시각화 + 오른쪽 가맹점 상태)
@@ -106,12 +163,11 @@ with col1:
     danger = indicator_row.get("위험임계치", None)
 
     # Prophet 시각화 (크기 축소)
-    if "fig" in indicator_row and indicator_row["fig"] is not None:
-        fig = indicator_row["fig"]
-        fig.set_size_inches(6, 3)  # 🔹 시각화 축소
-        st.pyplot(fig, use_container_width=False)
+    # 캐시된 PNG 바이트를 그대로 표시 → rerun마다 matplotlib 재렌더링 없음
+    if "png" in indicator_row and indicator_row["png"] is not None:
+        st.image(indicator_row["png"])
     else:
-        st.warning("⚠️ 그래프 객체(fig)가 없습니다. Prophet 함수가 fig를 반환하도록 수정하세요.")
+        st.warning("⚠️ 그래프 이미지(png)가 없습니다. Prophet 함수가 png를 반환하도록 수정하세요.")
 
     # 성능 요약 카드
     st.markdown("### 📊 예측 성능 요약")
@@ -139,9 +195,15 @@ with col2:
     store_id_input = st.text_input("가맹점 ID 입력", placeholder="예: 000F03E44A")
 
     if store_id_input:
-        filtered = store_df[
-            store_df["가맹점"].astype(str).str.contains(store_id_input.strip(), case=False, na=False)
-        ]
+        query = store_id_input.strip().lower()
+        if query in store_id_index:
+            # 정확히 일치하는 ID: 인덱스 조회로 바로 선택
+            filtered = store_df.iloc[store_id_index[query]]
+        else:
+            # 부분 입력: 부분 문자열 검색으로 대체
+            filtered = store_df[
+                store_df["_id_lower"].str.contains(query, regex=False, na=False)
+            ]
 
         if filtered.empty:
             st.warning("❌ 해당 가맹점 ID를 찾을 수 없습니다.")
@@ -149,31 +211,23 @@ with col2:
             st.success(f"✅ {store_id_input} 검색 결과 ({len(filtered)}개 지표)")
             st.markdown("---")
 
-            # 색상 매핑
-            color_map = {
-                "안전": "#1f77b4",  # 파랑
-                "경고": "#ffbf00",  # 노랑
-                "위험": "#d62728"   # 빨강
-            }
-
-            # 각 지표별 미래 상태 표시
-            for _, row in filtered.iterrows():
-                indicator = str(row["지표"]).strip()
-                status = str(row["미래상태"]).strip()
-                color = color_map.get(status, "#555")
-                st.markdown(
-                    f"""
-                    <div style='background-color:{color}22;
-                                border-left:5px solid {color};
-                                padding:10px;
-                                border-radius:8px;
-                                margin-bottom:8px;'>
-                        <b style='color:{color}; font-size:16px;'>{indicator}</b><br>
-                        <span style='color:{color}; font-weight:bold; font-size:18px;'>{status}</span>
-                    </div>
-                    """,
-                    unsafe_allow_html=True
-                )
+            # 각 지표별 미래 상태 표시 (카드 HTML을 한 번에 만들어 단일 markdown으로 출력)
+            indicator = filtered["지표"].astype(str).str.strip()
+            status = filtered["미래상태"].astype(str)
+            # 카테고리 코드로 색상 조회: 기타 값은 "#555"로, 결측(-1)은 마지막 원소 "#555"
+            codes = filtered["미래상태"].cat.codes.clip(upper=len(color_map)).to_numpy()
+            color = pd.Series(status_colors[codes], index=filtered.index)
+            cards = (
+                "<div style='background-color:" + color + "22;"
+                " border-left:5px solid " + color + ";"
+                " padding:10px;"
+                " border-radius:8px;"
+                " margin-bottom:8px;'>"
+                "<b style='color:" + color + "; font-size:16px;'>" + indicator + "</b><br>"
+                "<span style='color:" + color + "; font-weight:bold; font-size:18px;'>" + status + "</span>"
+                "</div>"
+            )
+            st.markdown(cards.str.cat(sep=""), unsafe_allow_html=True)
 
     else:
         st.info("🔍 오른쪽 입력창에 가맹점 ID를 입력하면 상태가 표시됩니다.")
@@ -2,11 +2,20 @@ from prophet import Prophet
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # 서버 렌더링 전용: GUI 백엔드 초기화 생략
 import matplotlib.pyplot as plt
+import matplotlib.font_manager as fm
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import seaborn as sns
 import re
 import os
+import io
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests  # 🔹 추가 (GitHub에서 폰트 다운로드용)
+import streamlit as st
 
 # =====================================
 # 🔤 NanumGothic 폰트 GitHub에서 불러오기
@@ -14,6 +23,7 @@ import requests  # 🔹 추가 (GitHub에서 폰트 다운로드용)
 # 🔹 Cloud 환경에 설치된 나눔고딕 경로
 font_path = "/usr/share/fonts/truetype/nanum/NanumGothic.ttf"
 
+# 폰트 캐시 재빌드 없이 addfont만 사용 (모듈 import 시 1회 실행)
 if os.path.exists(font_path):
     fm.fontManager.addfont(font_path)
     plt.rcParams["font.family"] = "NanumGothic"
@@ -28,24 +38,52 @@ sns.set_style("whitegrid")
 
 
 # ==========================
-# 데이터 불러오기
+# 데이터 불러오기 (st.cache_data로 rerun 간 재사용)
 # ==========================
+# 원본 xlsx를 zstd 압축 Parquet로 1회 변환해 사용 (openpyxl 파싱 비용 제거)
+#   pd.read_excel("KPI_file.xlsx").to_parquet("KPI_file.parquet", compression="zstd", index=False)
+#   pd.read_excel("threshold.xlsx").to_parquet("threshold.parquet", compression="zstd", index=False)
+KPI_PATH = "KPI_file.parquet"
+THRESHOLD_PATH = "threshold.parquet"
+
+
+# 공백/NBSP(\u00A0)/zero-width space(\u200B) 제거용 패턴 (한 번만 컴파일)
+_WS_RE = re.compile(r'[\s\u00A0\u200B]+')
+
+
+@st.cache_data
+def load_kpi(mtime=None):
+    """가맹점 KPI 데이터를 읽고 컬럼명을 정규화 (mtime은 캐시 무효화 키)"""
+    df = pd.read_parquet(KPI_PATH)
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+
+@st.cache_data
+def load_threshold(mtime=None):
+    """지표별 임계치 데이터를 읽고 '지표'를 인덱스로 정규화 (mtime은 캐시 무효화 키)"""
+    df = pd.read_parquet(THRESHOLD_PATH)
+    df['지표'] = df['지표'].astype(str).str.replace(_WS_RE, "", regex=True)
+    df.set_index('지표', inplace=True)
+    df.index = [str(i).strip() for i in df.index]
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+
 try:
-    last_df = pd.read_excel("KPI_file.xlsx")
-    threshold_df = pd.read_excel("threshold.xlsx")
+    last_df = load_kpi(os.path.getmtime(KPI_PATH))
+    threshold_df = load_threshold(os.path.getmtime(THRESHOLD_PATH))
 except FileNotFoundError as e:
     raise FileNotFoundError(
-        f"❌ 파일을 찾을 수 없습니다. 같은 폴더(main)에 KPI_file.xlsx와 threshold.xlsx가 있는지 확인하세요.\n세부 오류: {e}"
+        f"❌ 파일을 찾을 수 없습니다. 같은 폴더(main)에 KPI_file.parquet와 threshold.parquet가 있는지 확인하세요.\n세부 오류: {e}"
     )
 
-threshold_df['지표'] = threshold_df['지표'].astype(str).str.replace(" ", "")
-threshold_df.set_index('지표', inplace=True)
-
 
 
 # ==========================
 # 문자열 정규화 함수 (공백/유니코드 공백 제거)
 # ==========================
+@lru_cache(maxsize=2048)
 def _norm(s: object) -> str:
     """
     문자열을 정규화:
@@ -53,22 +91,23 @@ def _norm(s: object) -> str:
     - 일반 공백, NBSP(\u00A0), zero-width space(\u200B) 제거
     - 대소문자/공백 무시 일관 처리
     """
-    return re.sub(r'\s+', '', str(s)).replace('\u00A0', '').replace('\u200B', '').strip()
-
-# 인덱스/컬럼 정규화
-last_df.columns = [str(c).strip() for c in last_df.columns]
-threshold_df.index = [str(i).strip() for i in threshold_df.index]
-threshold_df.columns = [str(c).strip() for c in threshold_df.columns]
+    return _WS_RE.sub('', str(s)).strip()
 
 # ==========================
 # 안전 매칭을 위한 맵 구성
 # ==========================
-_idx_map = {_norm(i): i for i in threshold_df.index}
-_col_map = {_norm(c): c for c in threshold_df.columns}
+def _threshold_maps(threshold_df):
+    """
+    전달받은 threshold_df 기준으로 매칭 정보를 구성 (데이터 변경 시에도 최신 라벨 반영):
+    - 정규화된 지표명 → 원래 인덱스 맵
+    - 경고/위험 임계치 컬럼명 자동 인식
+    """
+    idx_map = dict(zip(threshold_df.index.astype(str).str.replace(_WS_RE, '', regex=True), threshold_df.index))
+    col_map = dict(zip(threshold_df.columns.astype(str).str.replace(_WS_RE, '', regex=True), threshold_df.columns))
 
-# 임계치 컬럼 자동 인식
-warn_col = _col_map.get(_norm("경고임계치"), "경고임계치")
-danger_col = _col_map.get(_norm("위험임계치"), "위험임계치")
+    warn_col = col_map.get(_norm("경고임계치"), "경고임계치")
+    danger_col = col_map.get(_norm("위험임계치"), "위험임계치")
+    return idx_map, warn_col, danger_col
 
 # ==========================
 # 평가 지표 함수
@@ -76,12 +115,24 @@ danger_col = _col_map.get(_norm("위험임계치"), "위험임계치")
 def evaluate_forecast(y_true, y_pred):
     mae = mean_absolute_error(y_true, y_pred)
     rmse = np.sqrt(mean_squared_error(y_true, y_pred))
-    mape = np.mean(np.abs((y_true - y_pred) / np.clip(np.abs(y_true), 1e-8, None))) * 100
+
+    # MAPE: 두 버퍼만 할당하고 나머지는 in-place 연산
+    y_true = np.asarray(y_true, dtype=float)
+    y_pred = np.asarray(y_pred, dtype=float)
+    denom = np.abs(y_true)
+    np.maximum(denom, 1e-8, out=denom)
+    err = np.subtract(y_true, y_pred)
+    np.abs(err, out=err)
+    np.divide(err, denom, out=err)
+    mape = err.mean() * 100
     return mae, rmse, mape
 
 # ==========================
 # Prophet 기반 시계열 예측 함수
 # ==========================
+# 추세선 플롯 최대 포인트 수 (초과 시 과거 구간을 간격 추출)
+_MAX_PLOT_POINTS = 300
+
 def evaluate_forecast_model_prophet(last_df, threshold_df, forecast_months=10, pre_close_months=6):
     """
     Prophet-based time-series forecasting (with English-only visualization)
@@ -92,31 +143,41 @@ def evaluate_forecast_model_prophet(last_df, threshold_df, forecast_months=10, p
     df = last_df.copy()
     df["ds"] = pd.to_datetime(df["기준년월"], format="%Y%m")
 
-    # Split alive and closed merchants
-    alive_df = df[df["폐업여부"] == 0].copy()
-    closed_df = df[df["폐업여부"] == 1].copy()
+    # One stable sort by (store, month): each store's rows are contiguous and ascending
+    sorted_df = df.sort_values(["가맹점구분번호", "ds"], kind="stable")
 
-    # Keep only last n months for closed stores
-    closed_pre = (
-        closed_df.sort_values(["가맹점구분번호", "ds"])
-        .groupby("가맹점구분번호", group_keys=False)
-        .apply(lambda g: g.tail(pre_close_months))
-    )
+    # Keep alive merchants as-is and only the last n months of closed ones,
+    # selected with one boolean mask (no alive/closed copies, no concat).
+    # Closed rows are already grouped by store, so the reverse rank is a linear numpy scan.
+    status = sorted_df["폐업여부"].to_numpy()
+    closed_pos = np.flatnonzero(status == 1)
+    vals = sorted_df["가맹점구분번호"].to_numpy()[closed_pos]
+    starts = np.flatnonzero(np.r_[True, vals[1:] != vals[:-1]])
+    sizes = np.diff(np.r_[starts, len(vals)])
+    rank = np.arange(len(vals)) - np.repeat(starts, sizes)
+    reverse_rank = np.repeat(sizes, sizes) - 1 - rank
 
-    total_df = pd.concat([alive_df, closed_pre], axis=0).reset_index(drop=True)
-    total_df = total_df.sort_values(["가맹점구분번호", "ds"])
+    keep = status == 0
+    keep[closed_pos[reverse_rank < pre_close_months]] = True
+    total_df = sorted_df.loc[keep]
+
+    # Sort by month once, shared by every KPI
+    # (the last-N-rows evaluation slice below depends on this row order)
+    total_df = total_df.sort_values("ds").reset_index(drop=True)
+
+    # Threshold label matching, built from the threshold_df passed in
+    idx_map, warn_col, danger_col = _threshold_maps(threshold_df)
 
     # KPI list
     indicators = ["매출안정성지표", "경쟁우위 지표", "고객 충성도 지표"]
-    results = []
 
-    for target in indicators:
+    def _fit_one(target):
         key = _norm(target)
-        matched_idx = _idx_map.get(key, None)
+        matched_idx = idx_map.get(key, None)
 
         if matched_idx is None:
             print(f"⚠️ Could not find threshold for '{target}' (normalized='{key}') → skipped")
-            continue
+            return None
 
         # Column check
         if target not in total_df.columns:
@@ -125,12 +186,12 @@ def evaluate_forecast_model_prophet(last_df, threshold_df, forecast_months=10, p
                 target = alt[0]
             else:
                 print(f"⚠️ '{target}' not found in last_df → skipped")
-                continue
+                return None
 
-        sub = total_df[["ds", target]].dropna().sort_values("ds").copy()
+        sub = total_df[["ds", target]].dropna()
         if len(sub) < 10:
             print(f"⚠️ Not enough data for '{target}' (len={len(sub)}) → skipped")
-            continue
+            return None
 
         prophet_df = sub.rename(columns={target: "y"})
 
@@ -139,13 +200,16 @@ def evaluate_forecast_model_prophet(last_df, threshold_df, forecast_months=10, p
             yearly_seasonality=True,
             weekly_seasonality=False,
             daily_seasonality=False,
-            changepoint_prior_scale=1
+            changepoint_prior_scale=1,
+            uncertainty_samples=0,  # yhat_lower/upper unused → skip interval sampling
+            mcmc_samples=0  # MAP fit (Prophet default, kept explicit)
         )
         m.fit(prophet_df)
 
         # Forecast
         future = m.make_future_dataframe(periods=forecast_months, freq="MS")
-        forecast = m.predict(future)
+        # Only ds/yhat are used below; drop trend/seasonality component columns
+        forecast = m.predict(future)[["ds", "yhat"]]
 
         # Evaluation
         y_true = prophet_df["y"].iloc[-min(forecast_months, len(prophet_df)):]
@@ -159,8 +223,22 @@ def evaluate_forecast_model_prophet(last_df, threshold_df, forecast_months=10, p
         # ==============================
         # 🎨 Visualization (English only)
         # ==============================
-        fig, ax = plt.subplots(figsize=(10, 5))
-        ax.plot(forecast["ds"], forecast["yhat"], color="#1f77b4", label="Predicted Trend")
+        # Build the Figure without pyplot so worker threads never share global state
+        # Rendered at the dashboard display size (6x3 in @ 100 dpi → 600x300 px)
+        fig = Figure(figsize=(6, 3), tight_layout=True)
+        FigureCanvasAgg(fig)
+        ax = fig.subplots()
+        # Thin out long histories (smooth trend); the forecast horizon stays at full resolution
+        n_points = len(forecast)
+        step = max(1, n_points // _MAX_PLOT_POINTS)
+        plot_idx = np.union1d(
+            np.arange(0, n_points, step),
+            np.arange(max(n_points - forecast_months, 0), n_points)
+        )
+        plot_df = forecast.iloc[plot_idx]
+
+        # Data line is rasterized; threshold lines / text stay vector
+        ax.plot(plot_df["ds"], plot_df["yhat"], color="#1f77b4", label="Predicted Trend", rasterized=True)
         ax.axhline(y=warn_th, color="orange", linestyle="--", label=f"Warning {warn_th:.3f}")
         ax.axhline(y=danger_th, color="red", linestyle="--", label=f"Danger {danger_th:.3f}")
         ax.axvspan(
@@ -182,10 +260,13 @@ def evaluate_forecast_model_prophet(last_df, threshold_df, forecast_months=10, p
         ax.set_ylabel("KPI Value")
         ax.legend()
         ax.grid(alpha=0.3)
-        plt.tight_layout()
+
+        # Render once to PNG bytes; the Figure itself is not kept in the results
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=100)
 
         # ✅ Save results
-        results.append({
+        return {
         "모델": "Prophet",
         "지표": english_title,
         "예측 평균": y_pred.mean(),
@@ -194,8 +275,18 @@ def evaluate_forecast_model_prophet(last_df, threshold_df, forecast_months=10, p
         "MAPE(%)": mape,
         "경고임계치": warn_th,
         "위험임계치": danger_th,
-        "fig": fig
-    })
+        "png": buf.getvalue()
+    }
+
+    # Fit the independent KPI models concurrently (Stan runs out-of-process via cmdstanpy)
+    with ThreadPoolExecutor(max_workers=len(indicators)) as ex:
+        futures = {ex.submit(_fit_one, t): i for i, t in enumerate(indicators)}
+        ordered = [None] * len(indicators)
+        for fut in as_completed(futures):
+            ordered[futures[fut]] = fut.result()
+
+    # Keep the original KPI order for the dashboard
+    results = [r for r in ordered if r is not None]
 
     # If no results
     if not results: